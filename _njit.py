@@ -0,0 +1,8 @@
+# Numba is optional. Code that uses it checks NUMBA_AVAILABLE and provides
+# a plain NumPy version for when it is not installed.
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    njit = None
+    NUMBA_AVAILABLE = False
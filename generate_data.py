@@ -1,29 +1,39 @@
 import pandas as pd
 import numpy as np
-from datetime import datetime, timedelta
+import argparse
 
-def generate():
-    # We will store all our generated rows in this list before creating the DataFrame
-    data = []
-    start_date = datetime(2023, 1, 1)
+# Optional Rust-backed Excel writer; fall back to pandas + xlsxwriter without it
+try:
+    from rustpy_xlsxwriter import FastExcel
+except ImportError:
+    FastExcel = None
+
+def generate(fmt="xlsx", seed=0):
+    # Every machine is measured once a day for 30 days
+    days = 30
+    dates = pd.date_range("2023-01-01", periods=days)
+    
+    # One seeded generator for every draw, so the same seed always gives the same log
+    rng = np.random.default_rng(seed)
     
     # 1. LINAC SIMULATION: 
 
     # This machine works perfectly until the very last day, where it breaks.
     # This is Useful for testing if our code catches single-point failures.
-    for i in range(30):
-        date = start_date + timedelta(days=i)
-        
-        # Generate normal daily readings with a tiny bit of random noise
-        dose = np.random.normal(100.0, 0.5)  # Target is 100
-        sym = np.random.normal(0.5, 0.2)     # Target is 0.5
-        
-        # On the last day (index 29), force a bad reading
-        if i == 29:
-            dose = 104.5 # This is >2% deviation, so it should trigger a fail
-            
-        data.append([date, "Linac_1", "Dose_Output", dose])
-        data.append([date, "Linac_1", "Symmetry", sym])
+
+    # Generate normal daily readings with a tiny bit of random noise
+    dose = rng.normal(100.0, 0.5, days)  # Target is 100
+    sym = rng.normal(0.5, 0.2, days)     # Target is 0.5
+    
+    # On the last day (index 29), force a bad reading
+    dose[29] = 104.5 # This is >2% deviation, so it should trigger a fail
+
+    linac = pd.DataFrame({
+        "Date": dates.repeat(2),
+        "Machine_ID": "Linac_1",
+        "Metric": np.tile(["Dose_Output", "Symmetry"], days),
+        "Value": np.stack([dose, sym], axis=1).ravel(),
+    })
 
     # 2. CT SCANNER SIMULATION: 
 
@@ -31,47 +41,63 @@ def generate():
     # This is Useful for testing if our linear regression (slope check) works.
     
     # Create a smooth array of 30 values going from 0 up to 6
-    drift_values = np.linspace(0, 6.0, 30) 
+    drift_values = np.linspace(0, 6.0, days) 
     
-    for i in range(30):
-        date = start_date + timedelta(days=i)
-        # Take the drift value and add some random noise so it looks like real data
-        val = drift_values[i] + np.random.normal(0, 0.5) 
-        data.append([date, "CT_Scanner_A", "Water_HU", val])
+    # Take the drift values and add some random noise so it looks like real data
+    ct = pd.DataFrame({
+        "Date": dates,
+        "Machine_ID": "CT_Scanner_A",
+        "Metric": "Water_HU",
+        "Value": drift_values + rng.normal(0, 0.5, days),
+    })
 
     # 3. GAMMA CAMERA SIMULATION: 
 
     # This machine never fails. It's our control group.
-    for i in range(30):
-        date = start_date + timedelta(days=i)
-        val = np.random.normal(2.5, 0.1) # Fluctuate slightly around 2.5%
-        data.append([date, "Gamma_Cam_SPECT", "Uniformity", val])
+    gamma = pd.DataFrame({
+        "Date": dates,
+        "Machine_ID": "Gamma_Cam_SPECT",
+        "Metric": "Uniformity",
+        "Value": rng.normal(2.5, 0.1, days), # Fluctuate slightly around 2.5%
+    })
 
     # 4. MRI SCANNER SIMULATION:
 
     # This simulates a loose cable or bad connection.
     # It works most days, but fails randomly (spikes) on specific days.
 
-    for i in range(30):
-        date = start_date + timedelta(days=i)
-        
-        # Signal-to-Noise Ratio (SNR): Target is 50
-        snr_val = np.random.normal(50.0, 1.0)
-        
-        # Force a failure on day 10 and day 20 (random drops in signal)
-        if i == 10 or i == 20:
-            snr_val = 42.0 # Significant drop, should fail
-        
-        # Geometric Distortion: Stays very stable
-        dist_val = abs(np.random.normal(0.2, 0.05))
+    # Signal-to-Noise Ratio (SNR): Target is 50
+    snr_val = rng.normal(50.0, 1.0, days)
+    
+    # Force a failure on day 10 and day 20 (random drops in signal)
+    snr_val[[10, 20]] = 42.0 # Significant drop, should fail
+    
+    # Geometric Distortion: Stays very stable
+    dist_val = np.abs(rng.normal(0.2, 0.05, days))
 
-        data.append([date, "MRI_Scanner_3T", "SNR_Coil_1", snr_val])
-        data.append([date, "MRI_Scanner_3T", "Geometric_Distortion", dist_val])
+    mri = pd.DataFrame({
+        "Date": dates.repeat(2),
+        "Machine_ID": "MRI_Scanner_3T",
+        "Metric": np.tile(["SNR_Coil_1", "Geometric_Distortion"], days),
+        "Value": np.stack([snr_val, dist_val], axis=1).ravel(),
+    })
 
-    # Convert our list of lists into a Pandas DataFrame and save it
-    df = pd.DataFrame(data, columns=["Date", "Machine_ID", "Metric", "Value"])
-    df.to_excel("daily_qc_log.xlsx", index=False)
-    print(f" [GENERATOR] Created 'daily_qc_log.xlsx' with {len(df)} records.")
+    # Stack all machines into one DataFrame and save it
+    df = pd.concat([linac, ct, gamma, mri], ignore_index=True)
+    out_path = f"daily_qc_log.{fmt}"
+    if fmt == "parquet":
+        # Compact columnar file for benchmarking; use xlsx when a person needs to open it
+        df.to_parquet(out_path, index=False, compression="snappy")
+    elif FastExcel is not None:
+        # Show dates the same way pandas' Excel writer does (no 'T' separator)
+        FastExcel(out_path).format(datetime_format="yyyy-mm-dd hh:mm:ss").sheet("Sheet1", df).save()
+    else:
+        df.to_excel(out_path, index=False, engine="xlsxwriter")
+    print(f" [GENERATOR] Created '{out_path}' with {len(df)} records.")
 
 if __name__ == "__main__":
-    generate()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Generate a simulated daily QC log")
+    parser.add_argument("--format", choices=["xlsx", "parquet"], default="xlsx", help="Output file format")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for the simulated readings")
+    args = parser.parse_args()
+    generate(args.format, args.seed)
@@ -1,22 +1,68 @@
 import pandas as pd
+import numpy as np
 import yaml
 import argparse
+import matplotlib
+matplotlib.use('Agg') # Render straight to PNG, no display needed (also safe in worker processes)
 import matplotlib.pyplot as plt
-from scipy.stats import linregress
 import os
 import sys
 import sqlite3
 import logging
+import multiprocessing
+from logging.handlers import QueueHandler, QueueListener
+from concurrent.futures import ProcessPoolExecutor
+from _njit import njit, NUMBA_AVAILABLE
 
-# Set up logging to write to both a file and the screen
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(message)s",
-    handlers=[
+# Optional Rust-backed Excel writer; fall back to pandas + xlsxwriter without it
+try:
+    from rustpy_xlsxwriter import FastExcel
+except ImportError:
+    FastExcel = None
+
+# Status codes produced by _status_codes, in label order
+STATUS_LABELS = np.array(["PASS", "FAIL", "UNKNOWN_CONFIG"], dtype=object)
+
+if NUMBA_AVAILABLE:
+    # Compiled serially on purpose: a parallel kernel starts numba's thread pool,
+    # which hangs interpreter shutdown once the plot workers are forked
+    @njit(cache=True)
+    def _status_codes(values, targets, tols):
+        # 0 = PASS, 1 = FAIL, 2 = no rule for this machine/metric
+        out = np.empty(values.size, np.int8)
+        for i in range(values.size):
+            if np.isnan(targets[i]):
+                out[i] = 2
+            elif abs(values[i] - targets[i]) > tols[i]:
+                out[i] = 1
+            else:
+                out[i] = 0
+        return out
+else:
+    def _status_codes(values, targets, tols):
+        # Same codes as the compiled loop, computed with plain NumPy
+        out = (np.abs(values - targets) > tols).astype(np.int8)
+        out[np.isnan(targets)] = 2
+        return out
+
+LOG_FORMAT = "%(asctime)s [%(levelname)s] %(message)s"
+
+def _start_logging(log_queue):
+    # Set up logging to write to both a file and the screen.
+    # Log calls only put the record on a queue; a background thread does the actual writing.
+    logging.basicConfig(level=logging.INFO, format=LOG_FORMAT, handlers=[QueueHandler(log_queue)])
+    listener = QueueListener(
+        log_queue,
         logging.FileHandler("qc_audit.log"),
         logging.StreamHandler(sys.stdout)
-    ]
-)
+    )
+    listener.start()
+    return listener
+
+
+def _init_plot_worker(log_queue):
+    # Plot workers send their log records to the main process's listener
+    logging.basicConfig(level=logging.INFO, format=LOG_FORMAT, handlers=[QueueHandler(log_queue)])
 
 # stop matplotlib from cluttering the logs with debug info
 logging.getLogger('matplotlib').setLevel(logging.WARNING)
@@ -33,19 +79,41 @@ class QualityControlEngine:
         except FileNotFoundError:
             logging.error(f"Configuration file not found: {config_path}")
             sys.exit(1)
+
+        # Flatten the rules to (machine, metric) -> (target, tolerance, unit) for single lookups
+        self._flat_rules = {
+            (machine, metric): (rule['target'], rule['tolerance_abs'], rule.get('unit', ''))
+            for machine, machine_rules in self.rules.items()
+            for metric, rule in machine_rules.items()
+        }
+
+        # The same rules as a table so a whole log can be checked in one merge
+        self.rules_df = pd.DataFrame(
+            [(machine, metric, target, tol) for (machine, metric), (target, tol, _) in self._flat_rules.items()],
+            columns=['Machine_ID', 'Metric', 'target', 'tol']
+        )
             
         self.drift_alerts = []
+
+        # Create the report folders once up front (plots go in a subfolder of the reports)
+        os.makedirs("qc_reports/plots", exist_ok=True)
         
-        # Make sure the database is ready when we start
+        # Make sure the database is ready when we start.
+        # The same connection is kept open for the archive step and closed by close().
+        self._conn = None
         self.init_database()
 
     def init_database(self):
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            self._conn = sqlite3.connect(self.db_path)
+
+            # Tune the connection for bulk loads: no fsync per write, write-ahead journal
+            self._conn.execute('PRAGMA synchronous=OFF')
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA temp_store=MEMORY')
             
             # Create the table only if it doesn't exist yet
-            cursor.execute('''
+            self._conn.execute('''
                 CREATE TABLE IF NOT EXISTS qc_records (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
                     date TIMESTAMP,
@@ -56,25 +124,29 @@ class QualityControlEngine:
                     audit_timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                 )
             ''')
-            conn.commit()
-            conn.close()
+            self._conn.commit()
             logging.info(f"Database connection verified at {self.db_path}")
         except sqlite3.Error as e:
             logging.error(f"Database initialization failed: {e}")
 
     def save_to_database(self, df):
         try:
-            conn = sqlite3.connect(self.db_path)
+            # Store dates as text in a vectorized step, in the same format as before:
+            # microseconds are only written when they are non-zero
+            dates = df['Date'].dt.strftime('%Y-%m-%d %H:%M:%S')
+            fractional = df['Date'].dt.microsecond > 0
+            if fractional.any():
+                dates[fractional] = df.loc[fractional, 'Date'].dt.strftime('%Y-%m-%d %H:%M:%S.%f')
             
-            # Select only the columns we need for the database to avoid errors
-            data_to_save = df[['Date', 'Machine_ID', 'Metric', 'Value', 'QC_Status']].copy()
+            # Build rows straight from the columns we need, without copying them into a new DataFrame
+            rows = zip(dates, df['Machine_ID'], df['Metric'], df['Value'], df['QC_Status'])
             
-            # Rename columns to lowercase to match standard SQL style
-            data_to_save.columns = ['date', 'machine_id', 'metric', 'value', 'qc_status']
-            
-            # Write data to the table, appending to existing records
-            data_to_save.to_sql('qc_records', conn, if_exists='append', index=False)
-            conn.close()
+            # Write the rows as plain tuples inside a single transaction, appending to existing records
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT INTO qc_records (date, machine_id, metric, value, qc_status) VALUES (?, ?, ?, ?, ?)",
+                    rows
+                )
             
             logging.info(f"Successfully archived {len(df)} records to database.")
             return self.db_path
@@ -82,15 +154,19 @@ class QualityControlEngine:
             logging.error(f"Failed to save records to database: {e}")
             return None
 
+    def close(self):
+        # Release the database connection opened in init_database
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
     def check_compliance(self, machine, metric, value):
         # Check if we actually have a rule for this machine/metric in the config
-        if machine not in self.rules or metric not in self.rules[machine]:
+        rule = self._flat_rules.get((machine, metric))
+        if rule is None:
             logging.warning(f"Configuration missing for {machine} - {metric}")
             return "UNKNOWN_CONFIG"
-            
-        rule = self.rules[machine][metric]
-        target = rule['target']
-        tol = rule['tolerance_abs']
+        target, tol, _ = rule
         
         # See how far off the value is from the target
         diff = abs(value - target)
@@ -100,107 +176,210 @@ class QualityControlEngine:
             return f"FAIL (Dev: {diff:.2f})"
         return "PASS"
 
-    def analyze_drift(self, dates, values, machine, metric):
+    def check_compliance_vec(self, df):
+        # Same rules as check_compliance, but applied to every row at once
+        out = df[['Machine_ID', 'Metric', 'Value']].merge(self.rules_df, on=['Machine_ID', 'Metric'], how='left')
+        values = out['Value'].to_numpy(dtype=np.float64)
+        targets = out['target'].to_numpy(dtype=np.float64)
+        codes = _status_codes(values, targets, out['tol'].to_numpy(dtype=np.float64))
+
+        status = STATUS_LABELS[codes]
+        # Only the failing rows need the deviation formatted into the message
+        fail = codes == 1
+        status[fail] = [f"FAIL (Dev: {diff:.2f})" for diff in np.abs(values[fail] - targets[fail])]
+
+        # Warn once per missing machine/metric instead of once per row
+        missing = out.loc[codes == 2, ['Machine_ID', 'Metric']].drop_duplicates()
+        for machine, metric in zip(missing['Machine_ID'], missing['Metric']):
+            logging.warning(f"Configuration missing for {machine} - {metric}")
+
+        return pd.Series(status, index=df.index)
+
+    def analyze_drift(self, df):
+        # Put each machine/metric in its own column so all trend lines share one time axis
+        # DayIdx (days since the first reading) is added once when the log is loaded.
+        # Readings without a date can't be placed on the time axis, so they are left out of the fit.
+        df = df[df['DayIdx'].notna()]
+        Y = df.pivot_table(index='DayIdx', columns=['Machine_ID', 'Metric'], values='Value')
+        known = [key for key in Y.columns if key in self._flat_rules]
+        Y = Y[known]
+
+        days = Y.index.to_numpy(dtype=np.int64)
+        X = np.column_stack([np.ones(len(days)), days])
+        values = Y.to_numpy()
+        slopes = np.full(len(known), np.nan)
+
+        # Raw readings per machine/metric, before the pivot averages repeats on the same day
+        groups = df.groupby(['Machine_ID', 'Metric'])
+        n_readings = groups.size().reindex(known).to_numpy()
+
+        # Columns with exactly one reading every day can all be fitted with the same (X'X)^-1 X'
+        batched = ~np.isnan(values).any(axis=0) & (n_readings == len(days))
         # We need at least 5 points to make a reliable trend line
-        if len(values) < 5: 
-            return
-        
-        # Convert dates to number of days so we can do math on them
-        days = (dates - dates.min()).dt.days
-        slope, intercept, r, p, err = linregress(days, values)
-        
+        if len(days) >= 5 and batched.any():
+            XtX_inv_Xt = np.linalg.inv(X.T @ X) @ X.T
+            slopes[batched] = (XtX_inv_Xt @ values[:, batched])[1]
+
+        # Columns with gaps or repeated days are fitted one at a time on their raw readings
+        for i in np.flatnonzero(~batched):
+            if n_readings[i] < 5:
+                continue
+            group = groups.get_group(known[i]).dropna(subset=['Value'])
+            group_days = group['DayIdx'].to_numpy(dtype=np.int64)
+            # A trend needs readings on at least two different days
+            if np.unique(group_days).size < 2:
+                continue
+            slopes[i], _ = np.polyfit(group_days, group['Value'].to_numpy(), 1)
+
         # If the slope (rate of change) is too steep, warn the user
-        if abs(slope) > 0.1:
-            alert_msg = f"[{machine}] {metric}: Significant Drift detected (Slope: {slope:.3f}/day)"
-            self.drift_alerts.append(alert_msg)
-            logging.warning(alert_msg)
+        for (machine, metric), slope in zip(known, slopes):
+            if abs(slope) > 0.1:
+                alert_msg = f"[{machine}] {metric}: Significant Drift detected (Slope: {slope:.3f}/day)"
+                self.drift_alerts.append(alert_msg)
+                logging.warning(alert_msg)
 
-    def generate_plot(self, df_subset, machine, metric):
-        try:
-            rule = self.rules[machine][metric]
-            target = rule['target']
-            tol = rule['tolerance_abs']
-            
-            # Start a new plot
-            plt.figure(figsize=(10, 5))
-            plt.plot(df_subset['Date'], df_subset['Value'], 'o-', label='Measured')
-            
-            # Add horizontal lines for Target and Limits
-            plt.axhline(target, color='green', linestyle='--', label='Target')
-            plt.axhline(target + tol, color='red', linestyle=':', label='Upper Limit')
-            plt.axhline(target - tol, color='red', linestyle=':', label='Lower Limit')
-            
-            plt.title(f"QC Trend: {machine} - {metric}")
-            plt.ylabel(rule['unit'])
-            plt.legend()
-            plt.grid(True, alpha=0.3)
-            
-            # Create the folder if it's missing, then save the chart
-            os.makedirs("qc_reports/plots", exist_ok=True)
-            plot_path = f"qc_reports/plots/{machine}_{metric}.png"
-            plt.savefig(plot_path)
-            plt.close() # Close the plot to free up memory
-        except Exception as e:
-            logging.error(f"Failed to generate plot for {machine}-{metric}: {e}")
+
+# Each plotting process keeps one Figure alive and clears it between charts,
+# instead of building a new figure, canvas and renderer for every chart
+_figure = None
+_axes = None
+
+
+def _plot_axes():
+    global _figure, _axes
+    if _figure is None:
+        _figure, _axes = plt.subplots(figsize=(10, 5))
+    return _figure, _axes
+
+
+def _plot_group(task):
+    # Runs in a worker process, so it takes everything it needs as plain arguments.
+    # Errors are returned rather than logged so all logging stays in the main process.
+    df_subset, machine, metric, rule = task
+    fig, ax = _plot_axes()
+    try:
+        target = rule['target']
+        tol = rule['tolerance_abs']
+        
+        # Draw the measurements on the shared axes
+        ax.plot(df_subset['Date'], df_subset['Value'], 'o-', label='Measured')
+        
+        # Add horizontal lines for Target and Limits
+        ax.axhline(target, color='green', linestyle='--', label='Target')
+        ax.axhline(target + tol, color='red', linestyle=':', label='Upper Limit')
+        ax.axhline(target - tol, color='red', linestyle=':', label='Lower Limit')
+        
+        ax.set_title(f"QC Trend: {machine} - {metric}")
+        ax.set_ylabel(rule['unit'])
+        ax.legend()
+        ax.grid(True, alpha=0.3)
+        
+        # Save the chart (the folder is created by QualityControlEngine)
+        plot_path = f"qc_reports/plots/{machine}_{metric}.png"
+        # Light PNG compression: files are slightly larger but much faster to encode
+        fig.savefig(plot_path, pil_kwargs={'compress_level': 1})
+        return None
+    except Exception as e:
+        return f"Failed to generate plot for {machine}-{metric}: {e}"
+    finally:
+        ax.cla() # Clear the axes so the next chart starts empty
 
 
 def main():
     parser = argparse.ArgumentParser(description="Medical Physics QC Auditor (CLI)")
-    parser.add_argument("--input", required=True, help="Path to Excel data file")
+    parser.add_argument("--input", required=True, help="Path to Excel or Parquet data file")
     parser.add_argument("--config", default="config.yaml", help="Path to config file")
+    parser.add_argument("--format", choices=["xlsx", "parquet"], default="xlsx", help="Audit report file format")
     args = parser.parse_args()
 
+    # Plot workers are started fresh instead of forked from this process, which
+    # runs the log listener thread, and they log through the same queue
+    start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    mp_context = multiprocessing.get_context(start_method)
+    log_queue = mp_context.Queue()
+    log_listener = _start_logging(log_queue)
+    try:
+        _run_audit(args, mp_context, log_queue)
+    finally:
+        # Flush anything still queued, including when a step calls sys.exit
+        log_listener.stop()
+
+
+def _run_audit(args, mp_context, log_queue):
     logging.info("INITIALIZING MEDIPHYS QC AUDITOR...")
     
-    # 1. Load Resources and Data
+    # The engine opens the database, so close it on every exit path from here on
+    engine = None
     try:
-        engine = QualityControlEngine(args.config)
-        df = pd.read_excel(args.input)
-        df['Date'] = pd.to_datetime(df['Date'])
-        logging.info(f"Data loaded: {len(df)} records across {df['Machine_ID'].nunique()} machines.")
-    except Exception as e:
-        logging.critical(f"Critical error loading input files: {e}")
-        sys.exit(1)
-
-    # 2. Run Checks
-    # We loop through each row to check pass/fail status
-    logging.info("Running compliance checks...")
-    results = []
-    for idx, row in df.iterrows():
-        status = engine.check_compliance(row['Machine_ID'], row['Metric'], row['Value'])
-        results.append(status)
-    
-    df['QC_Status'] = results
-
-    # 3. Trends and Plots
-    # Group data by machine and metric to analyze history
-    logging.info("Analyzing trends and generating plots...")
-    groups = df.groupby(['Machine_ID', 'Metric'])
-    for (machine, metric), group_data in groups:
-        # Only run analysis if we recognize the machine/metric
-        if machine in engine.rules and metric in engine.rules[machine]:
-            engine.analyze_drift(group_data['Date'], group_data['Value'], machine, metric)
-            engine.generate_plot(group_data, machine, metric)
-
-    # 4. Save Everything
-    os.makedirs("qc_reports", exist_ok=True)
-    
-    # Save to database (append mode)
-    db_file = engine.save_to_database(df)
+        # 1. Load Resources and Data
+        try:
+            engine = QualityControlEngine(args.config)
+            if args.input.endswith(".parquet"):
+                df = pd.read_parquet(args.input)
+            else:
+                df = pd.read_excel(args.input, engine="calamine")
+            df['Date'] = pd.to_datetime(df['Date'])
+            # Convert dates to number of days once so the trend analysis can do math on them.
+            # Nullable, so a row with a missing date is still checked, plotted and archived.
+            df['DayIdx'] = (df['Date'] - df['Date'].min()).dt.days.astype('Int32')
+            logging.info(f"Data loaded: {len(df)} records across {df['Machine_ID'].nunique()} machines.")
+        except Exception as e:
+            logging.critical(f"Critical error loading input files: {e}")
+            sys.exit(1)
+
+        # 2. Run Checks
+        # Check pass/fail status for every row in one vectorized pass
+        logging.info("Running compliance checks...")
+        df['QC_Status'] = engine.check_compliance_vec(df)
+
+        # 3. Trends and Plots
+        # Group data by machine and metric to analyze history
+        logging.info("Analyzing trends and generating plots...")
+        engine.analyze_drift(df)
+        groups = df.groupby(['Machine_ID', 'Metric'])
+        valid_keys = set(engine._flat_rules)
+        tasks = []
+        for (machine, metric), group_data in groups:
+            # Only plot if we recognize the machine/metric
+            if (machine, metric) not in valid_keys:
+                continue
+            tasks.append((group_data[['Date', 'Value']], machine, metric, engine.rules[machine][metric]))
+
+        # Each chart is independent, so render them in parallel
+        with ProcessPoolExecutor(mp_context=mp_context, initializer=_init_plot_worker,
+                                 initargs=(log_queue,)) as executor:
+            for error in executor.map(_plot_group, tasks):
+                if error:
+                    logging.error(error)
+
+        # 4. Save Everything
+        # Save to database (append mode)
+        db_file = engine.save_to_database(df)
     
-    # Save to Excel (overwrite mode)
-    out_path = "qc_reports/audit_results.xlsx"
-    try:
-        df.to_excel(out_path, index=False)
-        logging.info(f"Excel report generated: {out_path}")
-    except Exception as e:
-        logging.error(f"Failed to save Excel report: {e}")
+        # Save the report (overwrite mode)
+        out_path = f"qc_reports/audit_results.{args.format}"
+        report = df.drop(columns=['DayIdx'])
+        try:
+            if args.format == "parquet":
+                report.to_parquet(out_path, index=False, compression="snappy")
+            elif FastExcel is not None:
+                # Show dates the same way pandas' Excel writer does (no 'T' separator)
+                FastExcel(out_path).format(datetime_format="yyyy-mm-dd hh:mm:ss").sheet("Sheet1", report).save()
+            else:
+                report.to_excel(out_path, index=False, engine="xlsxwriter")
+            logging.info(f"Report generated: {out_path}")
+        except Exception as e:
+            logging.error(f"Failed to save report: {e}")
+    finally:
+        # Always release the database connection, even if a step above fails
+        if engine is not None:
+            engine.close()
 
     # Print final summary to log
     logging.info("="*40)
     logging.info("       AUDIT COMPLETE       ")
     logging.info("="*40)
-    logging.info(f"1. Data Log (Excel): {out_path}")
+    logging.info(f"1. Data Log:         {out_path}")
     logging.info(f"2. History (DB):     {db_file} (Appended)")
     logging.info(f"3. Plots:            qc_reports/plots/")
     
@@ -0,0 +1,144 @@
+import argparse
+import os
+import subprocess
+import sys
+
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_main_runs_end_to_end_with_numba(tmp_path):
+    # The compiled compliance kernel and the plot worker pool must coexist:
+    # the audit has to finish and the interpreter has to exit on its own
+    pytest.importorskip("numba")
+    pytest.importorskip("python_calamine")
+
+    subprocess.run(
+        [sys.executable, os.path.join(REPO_ROOT, "generate_data.py")],
+        cwd=tmp_path, check=True, timeout=120
+    )
+    result = subprocess.run(
+        [sys.executable, os.path.join(REPO_ROOT, "main.py"),
+         "--input", "daily_qc_log.xlsx",
+         "--config", os.path.join(REPO_ROOT, "config.yaml")],
+        cwd=tmp_path, capture_output=True, text=True, timeout=120
+    )
+
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert "AUDIT COMPLETE" in result.stdout
+    assert (tmp_path / "qc_reports" / "audit_results.xlsx").exists()
+    assert len(list((tmp_path / "qc_reports" / "plots").glob("*.png"))) == 6
+
+
+def _drift_engine(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.syspath_prepend(REPO_ROOT)
+    import main
+    engine = main.QualityControlEngine(os.path.join(REPO_ROOT, "config.yaml"), db_path=str(tmp_path / "qc.db"))
+    return main, engine
+
+
+def _drift_log(main, rows):
+    # Same Date/DayIdx preparation as the load step in main.py
+    pd = main.pd
+    df = pd.DataFrame(rows, columns=["Date", "Machine_ID", "Metric", "Value"])
+    df["Date"] = pd.to_datetime(df["Date"])
+    df["DayIdx"] = (df["Date"] - df["Date"].min()).dt.days.astype("Int32")
+    return df
+
+
+def test_analyze_drift_counts_readings_not_days(tmp_path, monkeypatch):
+    # Six CT readings over three days, rising 1 HU/day, must still get a trend check
+    main, engine = _drift_engine(tmp_path, monkeypatch)
+    rows = [(f"2023-01-0{day + 1}", "CT_Scanner_A", "Water_HU", day + offset)
+            for day in range(3) for offset in (0.0, 0.2)]
+    engine.analyze_drift(_drift_log(main, rows))
+    engine.close()
+
+    assert len(engine.drift_alerts) == 1
+    assert "Slope: 1.000/day" in engine.drift_alerts[0]
+
+
+def test_analyze_drift_batched_matches_per_group_fit(tmp_path, monkeypatch):
+    # The batched solve (complete columns) and the per-column fit (gaps) agree with a plain polyfit
+    main, engine = _drift_engine(tmp_path, monkeypatch)
+    np = main.np
+    rows = []
+    for day in range(10):
+        date = f"2023-01-{day + 1:02d}"
+        rows.append((date, "CT_Scanner_A", "Water_HU", 0.3 * day + (day % 3) * 0.1))
+        if day != 4:
+            rows.append((date, "Linac_1", "Dose_Output", 100.0 - 0.2 * day + (day % 2) * 0.05))
+    df = _drift_log(main, rows)
+    engine.analyze_drift(df)
+    engine.close()
+
+    for machine, metric in [("CT_Scanner_A", "Water_HU"), ("Linac_1", "Dose_Output")]:
+        group = df[(df["Machine_ID"] == machine) & (df["Metric"] == metric)]
+        slope = np.polyfit(group["DayIdx"], group["Value"], 1)[0]
+        assert any(f"[{machine}] {metric}" in alert and f"{slope:.3f}" in alert for alert in engine.drift_alerts)
+
+
+def test_engine_closed_when_input_fails_to_load(tmp_path, monkeypatch):
+    # A bad input file exits the audit, but the database connection is still released
+    main, engine = _drift_engine(tmp_path, monkeypatch)
+    engine.close()
+    closed = []
+    monkeypatch.setattr(main.QualityControlEngine, "close", lambda self: closed.append(self))
+    args = argparse.Namespace(input=str(tmp_path / "missing.xlsx"),
+                              config=os.path.join(REPO_ROOT, "config.yaml"), format="xlsx")
+
+    with pytest.raises(SystemExit):
+        main._run_audit(args, None, None)
+    assert len(closed) == 1
+
+
+def test_save_to_database_keeps_fractional_seconds(tmp_path, monkeypatch):
+    # Dates are stored as sqlite3's datetime adapter wrote them: microseconds only when non-zero
+    main, engine = _drift_engine(tmp_path, monkeypatch)
+    pd = main.pd
+    df = pd.DataFrame({
+        "Date": pd.to_datetime(["2023-01-01 08:30:00", "2023-01-02 08:30:00.250000"], format="ISO8601"),
+        "Machine_ID": "Linac_1",
+        "Metric": "Dose_Output",
+        "Value": [100.0, 100.5],
+        "QC_Status": "PASS",
+    })
+    engine.save_to_database(df)
+    stored = [row[0] for row in engine._conn.execute("SELECT date FROM qc_records ORDER BY id")]
+    engine.close()
+
+    assert stored == [ts.to_pydatetime().isoformat(" ") for ts in df["Date"]]
+    assert stored == ["2023-01-01 08:30:00", "2023-01-02 08:30:00.250000"]
+
+
+def test_main_keeps_rows_with_missing_dates(tmp_path):
+    # One blank Date must not stop the audit: the row is still checked, archived and reported,
+    # and only the trend fit leaves it out
+    pytest.importorskip("pyarrow")
+    import sqlite3
+    import pandas as pd
+
+    subprocess.run(
+        [sys.executable, os.path.join(REPO_ROOT, "generate_data.py"), "--format", "parquet"],
+        cwd=tmp_path, check=True, timeout=120
+    )
+    log = pd.read_parquet(tmp_path / "daily_qc_log.parquet")
+    log.loc[7, "Date"] = pd.NaT
+    log.to_parquet(tmp_path / "daily_qc_log.parquet", index=False)
+
+    result = subprocess.run(
+        [sys.executable, os.path.join(REPO_ROOT, "main.py"),
+         "--input", "daily_qc_log.parquet", "--format", "parquet",
+         "--config", os.path.join(REPO_ROOT, "config.yaml")],
+        cwd=tmp_path, capture_output=True, text=True, timeout=120
+    )
+
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert "[CT_Scanner_A] Water_HU: Significant Drift detected" in result.stdout
+    report = pd.read_parquet(tmp_path / "qc_reports" / "audit_results.parquet")
+    assert len(report) == len(log)
+    assert pd.isna(report.loc[7, "Date"]) and report.loc[7, "QC_Status"] == "PASS"
+    with sqlite3.connect(tmp_path / "qc_history.db") as conn:
+        assert conn.execute("SELECT COUNT(*), SUM(date IS NULL) FROM qc_records").fetchone() == (len(log), 1)